@@ -1,6 +1,5 @@
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 from models import TaskListOutput
-import json
 
 SYSTEM_PROMPT = """You are an expert at converting voice transcripts into actionable Notion task lists.
 
@@ -27,30 +26,37 @@ Guidelines:
 * If a task has multiple steps, break it into a main task with indented sub-tasks
 * Ensure the output renders correctly in Notion's markdown format"""
 
+# Schema generation walks every field, so build it once at import
+_TASK_LIST_SCHEMA = TaskListOutput.model_json_schema()
+_USER_PREFIX = "Current date: "
 
-def process_transcript(client: Anthropic, transcript: str, current_date: str) -> TaskListOutput:
+# Structured output is obtained by forcing Claude to call a tool whose
+# input schema is TaskListOutput
+_TASK_LIST_TOOL = {
+    "name": "task_list_output",
+    "description": "Record the page title, summary and task checklist for the transcript",
+    "input_schema": _TASK_LIST_SCHEMA
+}
+
+
+async def process_transcript(client: AsyncAnthropic, transcript: str, current_date: str) -> TaskListOutput:
     """Process transcript through Claude API with structured outputs"""
-    user_message = f"Current date: {current_date}\n\nTranscript:\n{transcript}"
+    user_message = f"{_USER_PREFIX}{current_date}\n\nTranscript:\n{transcript}"
     
-    response = client.messages.create(
+    async with client.messages.stream(
         model="claude-sonnet-4-20250514",
         max_tokens=4096,
         system=SYSTEM_PROMPT,
         messages=[
             {"role": "user", "content": user_message}
         ],
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "task_list_output",
-                "strict": True,
-                "schema": TaskListOutput.model_json_schema()
-            }
-        }
-    )
+        tools=[_TASK_LIST_TOOL],
+        tool_choice={"type": "tool", "name": _TASK_LIST_TOOL["name"]}
+    ) as stream:
+        # The SDK accumulates the tool input as stream events arrive
+        message = await stream.get_final_message()
     
-    # Extract JSON from response
-    json_text = response.content[0].text
-    data = json.loads(json_text)
-    return TaskListOutput(**data)
+    # Extract structured output from the forced tool call
+    tool_use = next(block for block in message.content if block.type == "tool_use")
+    return TaskListOutput(**tool_use.input)
 
@@ -1,10 +1,41 @@
-from notion_client import Client
+import asyncio
+import re
+from notion_client import AsyncClient
 from models import TaskListOutput
+from utils import retry_async, CONNECT_ERRORS
 
+# Notion caps the number of children per create/append request
+MAX_CHILDREN_PER_REQUEST = 100
 
-def query_new_transcripts(notion: Client, database_id: str, after_time: str):
+# Caps concurrent in-flight Notion requests; this is a concurrency bound,
+# not a rate limit, so 429s are still handled by retry_async
+NOTION_SEMAPHORE = asyncio.Semaphore(3)
+
+# Matches '- [ ] task' checklist lines (any indentation), capturing the task text.
+# [^\S\n] is any whitespace except newline, so a match never spans lines
+_TASK_RE = re.compile(r'^[^\S\n]*- \[ \][^\S\n]*(\S.*?)[^\S\n]*$', re.MULTILINE)
+_TODO_TEMPLATE = {"object": "block", "type": "to_do"}
+
+# Fixed page scaffolding, shared across calls (never mutated)
+_SUMMARY_HEADING = {
+    "object": "block",
+    "type": "heading_2",
+    "heading_2": {
+        "rich_text": [{"type": "text", "text": {"content": "Summary"}}]
+    }
+}
+_TASKS_HEADING = {
+    "object": "block",
+    "type": "heading_3",
+    "heading_3": {
+        "rich_text": [{"type": "text", "text": {"content": "Tasks"}}]
+    }
+}
+
+
+async def query_new_transcripts(notion: AsyncClient, database_id: str, after_time: str):
     """Query Notion database for new transcript entries after specified timestamp"""
-    response = notion.databases.query(
+    response = await notion.databases.query(
         database_id=database_id,
         filter={
             "timestamp": "created_time",
@@ -42,74 +73,58 @@ def extract_transcript_text(page):
 
 def parse_tasks_to_blocks(tasks_markdown: str):
     """Convert markdown checklist to Notion to_do blocks"""
-    blocks = []
-    lines = tasks_markdown.split('\n')
-    
-    for line in lines:
-        line = line.rstrip()
-        if not line or not line.strip().startswith('- [ ]'):
-            continue
-            
-        # Count leading tabs/spaces for indentation
-        stripped = line.lstrip()
-        
-        # Extract task text (remove '- [ ]' prefix)
-        task_text = stripped.replace('- [ ]', '').strip()
-        
-        if task_text:
-            blocks.append({
-                "object": "block",
-                "type": "to_do",
-                "to_do": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {"content": task_text}
-                        }
-                    ],
-                    "checked": False
-                }
-            })
-            # Note: Notion API doesn't support indentation in create request
-            # Sub-tasks will appear as separate blocks
-    
-    return blocks
+    # Note: Notion API doesn't support indentation in create request
+    # Sub-tasks will appear as separate blocks
+    return [
+        {
+            **_TODO_TEMPLATE,
+            "to_do": {
+                "rich_text": [
+                    {
+                        "type": "text",
+                        "text": {"content": match.group(1)}
+                    }
+                ],
+                "checked": False
+            }
+        }
+        for match in _TASK_RE.finditer(tasks_markdown)
+    ]
+
 
+def _paragraph(text: str):
+    """Build a paragraph block containing plain text"""
+    return {
+        "object": "block",
+        "type": "paragraph",
+        "paragraph": {
+            "rich_text": [{"type": "text", "text": {"content": text}}]
+        }
+    }
 
-def create_task_page(notion: Client, parent_page_id: str, output: TaskListOutput):
+
+async def create_task_page(notion: AsyncClient, parent_page_id: str, output: TaskListOutput):
     """Create Notion page with title, summary, and tasks"""
     
     # Build blocks: Summary heading + paragraph + Tasks heading + to_do blocks
     blocks = [
-        {
-            "object": "block",
-            "type": "heading_2",
-            "heading_2": {
-                "rich_text": [{"type": "text", "text": {"content": "Summary"}}]
-            }
-        },
-        {
-            "object": "block",
-            "type": "paragraph",
-            "paragraph": {
-                "rich_text": [{"type": "text", "text": {"content": output.summary}}]
-            }
-        },
-        {
-            "object": "block",
-            "type": "heading_3",
-            "heading_3": {
-                "rich_text": [{"type": "text", "text": {"content": "Tasks"}}]
-            }
-        }
+        _SUMMARY_HEADING,
+        _paragraph(output.summary),
+        _TASKS_HEADING,
+        *parse_tasks_to_blocks(output.tasks)
     ]
     
-    # Add task blocks
-    task_blocks = parse_tasks_to_blocks(output.tasks)
-    blocks.extend(task_blocks)
+    # Split blocks into request-sized chunks
+    chunks = [
+        blocks[i:i + MAX_CHILDREN_PER_REQUEST]
+        for i in range(0, len(blocks), MAX_CHILDREN_PER_REQUEST)
+    ]
     
-    # Create page
-    response = notion.pages.create(
+    # Creates and appends are not idempotent, so only retry rate limits and
+    # connection failures where the request never reached Notion
+    
+    # Create page with the first chunk
+    response = await retry_async(lambda: notion.pages.create(
         parent={"page_id": parent_page_id},
         properties={
             "title": {
@@ -121,8 +136,18 @@ def create_task_page(notion: Client, parent_page_id: str, output: TaskListOutput
                 ]
             }
         },
-        children=blocks
-    )
+        children=chunks[0]
+    ), retry_on=(429,), retry_exceptions=CONNECT_ERRORS, semaphore=NOTION_SEMAPHORE)
+    
+    # Append remaining chunks in order (appends are not safe to run
+    # concurrently since Notion adds each batch to the end of the page)
+    for chunk in chunks[1:]:
+        await retry_async(
+            lambda chunk=chunk: notion.blocks.children.append(block_id=response["id"], children=chunk),
+            retry_on=(429,),
+            retry_exceptions=CONNECT_ERRORS,
+            semaphore=NOTION_SEMAPHORE
+        )
     
     return response
 
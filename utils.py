@@ -1,11 +1,28 @@
+import asyncio
+import contextlib
+import logging
+import random
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
+import httpx
+from anthropic import APIConnectionError, APIStatusError
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+
+_TZ = ZoneInfo("America/Detroit")
+
+# Errors where the request may or may not have reached the server
+TRANSIENT_ERRORS = (APIConnectionError, RequestTimeoutError, httpx.TransportError)
+# Errors raised before the request was sent, safe to retry for any call.
+# notion-client re-raises ConnectTimeout as RequestTimeoutError, which
+# retry_async looks through (see _is_retryable_error)
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+log = logging.getLogger("automation")
 
 
 def get_formatted_date():
     """Returns tuple: (page_title_date, full_date_string)"""
-    detroit_tz = pytz.timezone('America/Detroit')
-    now = datetime.now(detroit_tz)
+    now = datetime.now(_TZ)
     
     # For page title: "Sunday [10/27/25]"
     day_of_week = now.strftime("%A")
@@ -16,3 +33,64 @@ def get_formatted_date():
     
     return f"{day_of_week} [{short_date}]", full_date
 
+
+def _retry_after(e: Exception):
+    """Return the Retry-After delay in seconds from an SDK error, if present"""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or getattr(e, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_overloaded(e: Exception) -> bool:
+    """True for Anthropic overloaded_error bodies, including mid-stream errors sent with a 200 status"""
+    body = getattr(e, "body", None)
+    return isinstance(body, dict) and (body.get("error") or {}).get("type") == "overloaded_error"
+
+
+def _is_retryable_error(e: Exception, retry_exceptions) -> bool:
+    """Match retry_exceptions, looking through notion-client's RequestTimeoutError to the httpx error it wraps"""
+    if isinstance(e, retry_exceptions):
+        return True
+    return isinstance(e, RequestTimeoutError) and isinstance(e.__context__, retry_exceptions)
+
+
+async def retry_async(fn, *, retries=5, base=1.0, cap=30.0, jitter=0.1,
+                      retry_on=(429, 500, 502, 503, 504, 529), retry_exceptions=TRANSIENT_ERRORS,
+                      semaphore=None):
+    """
+    Await fn() with exponential backoff + jitter on rate limits and transient errors
+
+    A Retry-After header is honored as a minimum wait and is not capped.
+
+    Non-idempotent writes should narrow retry_on to (429,) and
+    retry_exceptions to CONNECT_ERRORS, since a 5xx or timeout may arrive
+    after the server already applied the request. If a semaphore is given
+    it is held only while each attempt is in flight, not while sleeping
+    between retries.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore or contextlib.nullcontext():
+                return await fn()
+        except (APIStatusError, HTTPResponseError) as e:
+            status = getattr(e, "status_code", None) or getattr(e, "status", None)
+            if (status not in retry_on and not _is_overloaded(e)) or attempt == retries:
+                raise
+            retry_after = _retry_after(e)
+        except Exception as e:
+            if attempt == retries or not _is_retryable_error(e, retry_exceptions):
+                raise
+            retry_after = None
+        
+        if retry_after is not None:
+            # Never retry sooner than the server asked: no cap, jitter only upward
+            delay = max(retry_after, base * 2 ** attempt) * (1 + random.uniform(0, jitter))
+        else:
+            delay = min(cap, base * 2 ** attempt) * (1 + random.uniform(-jitter, jitter))
+        log.warning(f"⏳ Retrying in {delay:.1f}s (attempt {attempt + 1}/{retries})")
+        await asyncio.sleep(delay)
@@ -3,32 +3,73 @@ Notion Webhook Server
 Receives real-time updates from Notion when database entries are created/updated
 """
 import os
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 import hmac
 import hashlib
-import json
+import orjson
 from typing import Dict, Any
+import httpx
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
-from notion_client import Client as NotionClient
-from anthropic import Anthropic
-from notion_api import extract_transcript_text, create_task_page
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import ORJSONResponse
+from notion_client import AsyncClient as NotionClient
+from anthropic import AsyncAnthropic
+from notion_api import extract_transcript_text, create_task_page, NOTION_SEMAPHORE
 from claude_client import process_transcript
-from utils import get_formatted_date
+from utils import get_formatted_date, retry_async
 
 # Load environment
 load_dotenv()
 
-app = FastAPI(title="Notion Transcript Automation")
+# Shared HTTP connection pools (one per host) so keep-alive sockets are
+# reused across webhook events instead of re-handshaking on every call
+HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=50, keepalive_expiry=60)
+# notion-client overrides the httpx client's timeout with its timeout_ms option
+NOTION_TIMEOUT_MS = 30_000
+# Claude responses can take minutes, so keep the SDK's 600s default here
+ANTHROPIC_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+notion_http = httpx.AsyncClient(limits=HTTP_LIMITS)
+anthropic_http = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=ANTHROPIC_TIMEOUT)
 
 # Initialize clients
-notion = NotionClient(auth=os.getenv("NOTION_TOKEN"))
-claude = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+notion = NotionClient(auth=os.getenv("NOTION_TOKEN"), client=notion_http, timeout_ms=NOTION_TIMEOUT_MS)
+claude = AsyncAnthropic(
+    api_key=os.getenv("ANTHROPIC_API_KEY"),
+    http_client=anthropic_http,
+    timeout=ANTHROPIC_TIMEOUT,
+    # Retries are handled by retry_async; nesting the SDK's own loop would
+    # multiply attempts and stack backoff
+    max_retries=0
+)
 
 # Configuration
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
 PARENT_PAGE_ID = os.getenv("NOTION_PARENT_PAGE_ID")
 DATABASE_ID = os.getenv("NOTION_DATABASE_ID")
+TARGET_DB_ID = (DATABASE_ID or "").replace("-", "")
+DEBUG = os.getenv("DEBUG") == "1"
+SIGNATURE_PREFIX = "sha256="
+SIGNATURE_LENGTH = len(SIGNATURE_PREFIX) + hashlib.sha256().digest_size * 2
+WORKER_COUNT = 4
+QUEUE_MAXSIZE = 1000
+# Time allowed on shutdown to finish queued pages (Render sends SIGKILL after 30s)
+SHUTDOWN_DRAIN_TIMEOUT = 25
+
+# Logging: records are handed off to a queue and written to stderr by a
+# listener thread, keeping stream I/O off the event loop
+log = logging.getLogger("automation")
+log.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+log.propagate = False
+_log_queue = SimpleQueue()
+log.addHandler(QueueHandler(_log_queue))
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream)
+_log_listener.start()
 
 
 def verify_signature(request_body: bytes, signature: str) -> bool:
@@ -37,11 +78,15 @@ def verify_signature(request_body: bytes, signature: str) -> bool:
     """
     if not WEBHOOK_SECRET:
         # If no secret is configured, skip validation (not recommended for production)
-        print("⚠️  Warning: WEBHOOK_SECRET not set, skipping signature validation")
+        log.warning("⚠️  Warning: WEBHOOK_SECRET not set, skipping signature validation")
         return True
     
+    # Reject malformed signatures before hashing the (attacker-controlled) body
+    if len(signature) != SIGNATURE_LENGTH or not signature.startswith(SIGNATURE_PREFIX):
+        return False
+    
     # Calculate expected signature
-    calculated_signature = "sha256=" + hmac.new(
+    calculated_signature = SIGNATURE_PREFIX + hmac.new(
         WEBHOOK_SECRET.encode("utf-8"),
         request_body,
         hashlib.sha256
@@ -56,41 +101,99 @@ async def process_transcript_async(page_id: str):
     Background task to process a transcript from a Notion page
     """
     try:
-        print(f"📝 Processing page: {page_id}")
+        log.info(f"📝 Processing page: {page_id}")
         
         # Retrieve the page from Notion
-        page = notion.pages.retrieve(page_id=page_id)
+        page = await retry_async(
+            lambda: notion.pages.retrieve(page_id=page_id),
+            semaphore=NOTION_SEMAPHORE
+        )
         
         # Extract transcript text
         transcript_text = extract_transcript_text(page)
         
         if not transcript_text:
-            print(f"⚠️  No transcript text found in page {page_id}")
+            log.warning(f"⚠️  No transcript text found in page {page_id}")
             return
         
-        print(f"✓ Found transcript ({len(transcript_text)} chars)")
+        log.info(f"✓ Found transcript ({len(transcript_text)} chars)")
         
         # Get formatted date for page title
         page_title_date, full_date = get_formatted_date()
         
-        # Process with Claude
-        print("🤖 Sending to Claude API...")
-        structured_output = process_transcript(claude, transcript_text, full_date)
+        # Process with Claude (concurrency is bounded by WORKER_COUNT)
+        log.info("🤖 Sending to Claude API...")
+        structured_output = await retry_async(
+            lambda: process_transcript(claude, transcript_text, full_date)
+        )
         
         # Override page title with formatted date
         structured_output.page_title = page_title_date
         
         # Create Notion page
-        print("📄 Creating Notion page...")
-        created_page = create_task_page(notion, PARENT_PAGE_ID, structured_output)
+        log.info("📄 Creating Notion page...")
+        created_page = await create_task_page(notion, PARENT_PAGE_ID, structured_output)
         
-        print(f"✅ Created page: {structured_output.page_title}")
-        print(f"🔗 URL: {created_page['url']}")
+        log.info(f"✅ Created page: {structured_output.page_title}")
+        log.info(f"🔗 URL: {created_page['url']}")
         
     except Exception as e:
-        print(f"❌ Error processing transcript: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"❌ Error processing transcript: {e}")
+
+
+async def worker(queue: asyncio.Queue, in_flight: set):
+    """
+    Long-lived worker that processes queued pages one at a time
+    """
+    while True:
+        page_id = await queue.get()
+        in_flight.add(page_id)
+        try:
+            await process_transcript_async(page_id)
+        finally:
+            in_flight.discard(page_id)
+            queue.task_done()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Run the worker pool for the lifetime of the app
+
+    On shutdown, drain the queue, stop workers, close pooled HTTP
+    connections and flush logs.
+    """
+    app.state.queue = asyncio.Queue(maxsize=QUEUE_MAXSIZE)
+    app.state.in_flight = set()
+    app.state.workers = [
+        asyncio.create_task(worker(app.state.queue, app.state.in_flight))
+        for _ in range(WORKER_COUNT)
+    ]
+    
+    yield
+    
+    # Give queued and in-flight pages a chance to finish before cancelling
+    try:
+        await asyncio.wait_for(app.state.queue.join(), timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        log.warning(
+            f"⚠️  Shutdown drain timed out: dropping {app.state.queue.qsize()} queued page(s), "
+            f"cancelling in-flight page(s): {sorted(app.state.in_flight)}"
+        )
+    
+    for task in app.state.workers:
+        task.cancel()
+    await asyncio.gather(*app.state.workers, return_exceptions=True)
+    await notion_http.aclose()
+    await anthropic_http.aclose()
+    _log_listener.stop()
+
+
+app = FastAPI(
+    title="Notion Transcript Automation",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
 
 
 @app.get("/")
@@ -117,34 +220,35 @@ async def health():
 
 
 @app.post("/webhook")
-async def webhook(request: Request, background_tasks: BackgroundTasks):
+async def webhook(request: Request):
     """
     Main webhook endpoint to receive events from Notion
     """
     # Get raw body for signature verification
     body_bytes = await request.body()
-    body = json.loads(body_bytes.decode("utf-8"))
     
     # Get signature from headers
     signature = request.headers.get("X-Notion-Signature", "")
     
     # Verify signature
     if not verify_signature(body_bytes, signature):
-        print("❌ Invalid signature - request rejected")
+        log.error("❌ Invalid signature - request rejected")
         raise HTTPException(status_code=401, detail="Invalid signature")
     
+    body = orjson.loads(body_bytes)
+    
     # Handle verification challenge (initial webhook setup)
     if "verification_token" in body:
-        print("🔐 Received verification token")
+        log.info("🔐 Received verification token")
         verification_token = body["verification_token"]
-        print(f"Token: {verification_token}")
-        print("⚠️  Copy this token to your Notion webhook settings to complete verification!")
-        return JSONResponse(content={"received": True})
+        log.info(f"Token: {verification_token}")
+        log.warning("⚠️  Copy this token to your Notion webhook settings to complete verification!")
+        return {"received": True}
     
     # Handle actual webhook events
     event_type = body.get("type")
     
-    print(f"\n📨 Received webhook event: {event_type}")
+    log.info(f"📨 Received webhook event: {event_type}")
     
     # Process data_source.content_updated events (when database content changes)
     if event_type == "data_source.content_updated":
@@ -153,54 +257,66 @@ async def webhook(request: Request, background_tasks: BackgroundTasks):
         event_data = body.get("data", {})
         
         # DEBUG: Log the full payload structure
-        print(f"🔍 DEBUG - Full event data: {json.dumps(body, indent=2)}")
+        if DEBUG:
+            log.debug(f"🔍 DEBUG - Full event data: {orjson.dumps(body, option=orjson.OPT_INDENT_2).decode()}")
         
         # Verify this is a data_source entity
         if entity.get("type") == "data_source":
             data_source_id = entity.get("id", "").replace("-", "")
-            target_db_id = DATABASE_ID.replace("-", "")
             
             # DEBUG: Log entity info
-            print(f"🔍 DEBUG - Data Source ID: {data_source_id}")
-            print(f"🔍 DEBUG - Target DATABASE_ID: {target_db_id}")
+            log.debug(f"🔍 DEBUG - Data Source ID: {data_source_id}")
+            log.debug(f"🔍 DEBUG - Target DATABASE_ID: {TARGET_DB_ID}")
             
             # Only process events from our target database
-            if data_source_id == target_db_id:
-                print(f"✓ Event is from target database")
+            if data_source_id == TARGET_DB_ID:
+                log.info(f"✓ Event is from target database")
                 
                 # Extract the updated blocks (pages that were added/updated)
                 updated_blocks = event_data.get("updated_blocks", [])
                 
                 if updated_blocks:
-                    print(f"✓ Found {len(updated_blocks)} updated block(s)")
+                    log.info(f"✓ Found {len(updated_blocks)} updated block(s)")
                     
-                    # Process each updated block (page) in the background
+                    # Collect each updated block (page) for the worker pool
+                    page_ids = []
                     for block in updated_blocks:
                         block_id = block.get("id")
                         block_type = block.get("type")
                         
-                        print(f"🔍 DEBUG - Block ID: {block_id}, Type: {block_type}")
+                        log.debug(f"🔍 DEBUG - Block ID: {block_id}, Type: {block_type}")
                         
                         if block_id and block_type == "block":
                             # The block ID is actually a page ID when it's a database child
-                            print(f"✓ Processing block as page: {block_id}")
-                            background_tasks.add_task(process_transcript_async, block_id)
+                            page_ids.append(block_id)
+                    
+                    # Never block the response on a full queue: reject the whole
+                    # event with 503 so Notion redelivers it, rather than queueing
+                    # part of it and duplicating those pages on redelivery
+                    queue = app.state.queue
+                    if queue.maxsize - queue.qsize() < len(page_ids):
+                        log.error(f"❌ Queue full, dropping page(s) {page_ids} for redelivery")
+                        raise HTTPException(status_code=503, detail="Queue full")
+                    
+                    for page_id in page_ids:
+                        log.info(f"✓ Processing block as page: {page_id}")
+                        queue.put_nowait(page_id)
                 else:
-                    print(f"ℹ️  No updated blocks in event")
+                    log.info(f"ℹ️  No updated blocks in event")
             else:
-                print(f"ℹ️  Event from different database (ID: {data_source_id}), ignoring")
+                log.info(f"ℹ️  Event from different database (ID: {data_source_id}), ignoring")
         else:
-            print(f"ℹ️  Event entity is not a data_source, ignoring")
+            log.info(f"ℹ️  Event entity is not a data_source, ignoring")
     else:
-        print(f"ℹ️  Event type '{event_type}' not handled")
+        log.info(f"ℹ️  Event type '{event_type}' not handled")
     
-    return JSONResponse(content={"received": True})
+    return {"received": True}
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", "8000"))
-    print(f"🚀 Starting webhook server on port {port}")
-    print(f"📍 Webhook URL: http://localhost:{port}/webhook")
+    log.info(f"🚀 Starting webhook server on port {port}")
+    log.info(f"📍 Webhook URL: http://localhost:{port}/webhook")
     uvicorn.run(app, host="0.0.0.0", port=port)
 